@@ -1,19 +1,28 @@
 """Script to montior Docker containers on host and alert on status,"""
 
+import binascii
 import os
+import queue
+import signal
 import sys
+import threading
 import time
-import datetime
-import base64
-import json
 import logging
-from email.mime.text import MIMEText
-from typing import Dict, List
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 
+import orjson
 import yaml
+
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # libyaml not available; pure-Python parser
+    from yaml import SafeLoader as _YamlLoader
+
 import docker
+import requests
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
 
 # === CONFIGURATION ===
 CONFIG_FILE = "./config.yaml"
@@ -23,24 +32,53 @@ def load_config() -> Dict:
     """Load configuration from a YAML file."""
     try:
         with open(CONFIG_FILE, "r", encoding="utf-8") as file:
-            return yaml.safe_load(file)
+            return yaml.load(file, Loader=_YamlLoader)
     except (FileNotFoundError, yaml.YAMLError) as err:
         logging.error("Failed to load config file '%s': %s", CONFIG_FILE, err)
         sys.exit(1)
 
 
-CONFIG = load_config()
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Immutable snapshot of config.yaml, built once at startup."""
+
+    server: str
+    containers: Tuple[str, ...]
+    alert_email: str
+    from_email: str
+    delegated_user: str
+    poll_interval: int  # seconds
+    docker_timeout: int  # seconds
+    log_level: str
+
+
+def _build_config() -> Config:
+    """Parse the YAML config into a frozen Config object."""
+    raw = load_config()
+    return Config(
+        server=raw.get("server", os.getenv("DOCKER_HOSTNAME", "unspecified-host")),
+        containers=tuple(raw.get("containers", [])),
+        alert_email=raw.get("alert_email"),
+        from_email=raw.get("from_email"),
+        delegated_user=raw.get("delegated_user"),
+        poll_interval=raw.get("poll_interval", 300),
+        docker_timeout=raw.get("docker_timeout", 10),
+        log_level=raw.get("log_level", "INFO").upper(),
+    )
+
+
+CFG = _build_config()
 
-SERVER = CONFIG.get("server", os.getenv("DOCKER_HOSTNAME", "unspecified-host"))
-CONTAINER_NAMES = CONFIG.get("containers", [])
-ALERT_EMAIL = CONFIG.get("alert_email")
-FROM_EMAIL = CONFIG.get("from_email")
-DELEGATED_USER = CONFIG.get("delegated_user")
-POLL_INTERVAL = CONFIG.get("poll_interval", 300)  # seconds
-LOG_LEVEL = CONFIG.get("log_level", "INFO").upper()
 STATE_DIR = "./status"
 STATE_FILE = os.path.join(STATE_DIR, "container_status.json")
-UNHEALTHY_STATES = ["unhealthy", "exited", "timeout", "unknown"]
+UNHEALTHY_STATES = frozenset({"unhealthy", "exited", "timeout", "unknown"})
+
+# Event-driven mode: alerts are batched and flushed at most this often, and a
+# full poll reconciles any missed events every HEARTBEAT_MULTIPLIER polls.
+ALERT_FLUSH_INTERVAL = 30  # seconds
+HEARTBEAT_MULTIPLIER = 10
+
+GMAIL_SEND_URL = "https://gmail.googleapis.com/gmail/v1/users/me/messages/send"
 
 SERVICE_ACCOUNT_FILE = "./service_account.json"
 if not os.path.isfile(SERVICE_ACCOUNT_FILE):
@@ -50,46 +88,140 @@ if not os.path.isfile(SERVICE_ACCOUNT_FILE):
     )
 
 logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL),
+    level=getattr(logging, CFG.log_level),
     format="%(asctime)s [%(levelname)s] %(message)s",
     handlers=[logging.StreamHandler()],
 )
 
 
-def authenticate_gmail_service():
-    """Authenticate and return a Gmail API service object."""
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=["https://www.googleapis.com/auth/gmail.send"]
-    ).with_subject(DELEGATED_USER)
-    return build("gmail", "v1", credentials=creds)
+_CREDS = None
+
+
+def _gmail_credentials():
+    """Load the delegated service-account credentials once and reuse them."""
+    global _CREDS
+    if _CREDS is None:
+        _CREDS = service_account.Credentials.from_service_account_file(
+            SERVICE_ACCOUNT_FILE,
+            scopes=["https://www.googleapis.com/auth/gmail.send"],
+        ).with_subject(CFG.delegated_user)
+    return _CREDS
+
+
+def authenticate_gmail_session() -> AuthorizedSession:
+    """Authenticate and return a session for the Gmail REST API.
+
+    The session pools its TLS connection to googleapis.com across sends
+    and refreshes the access token automatically when it expires.
+    """
+    return AuthorizedSession(_gmail_credentials())
+
+
+def _connect_docker() -> docker.APIClient:
+    """Open a low-level API connection to the Docker daemon."""
+    return docker.APIClient(
+        base_url="unix://var/run/docker.sock", timeout=CFG.docker_timeout
+    )
+
 
+_API = None
 
-def get_container_health(container_name: str) -> str:
-    """Get the health status of a Docker container."""
+
+def _docker_api() -> docker.APIClient:
+    """Return the shared API client, connecting on first use.
+
+    Connecting lazily means an unreachable daemon at startup is reported
+    through the normal "unknown" path instead of crashing at import time.
+    """
+    global _API
+    if _API is None:
+        _API = _connect_docker()
+    return _API
+
+
+def get_all_healths() -> Dict[str, str]:
+    """Get the health status of all configured containers in one API call."""
+    global _API
+
+    containers_cfg = CFG.containers
+    statuses = {name: "unknown" for name in containers_cfg}
+    if not containers_cfg:
+        return statuses
+
+    filters = {"name": list(containers_cfg)}
+    # A dead socket after a dockerd restart surfaces as a raw
+    # requests.ConnectionError, not a DockerException, so catch both.
+    errors = (docker.errors.DockerException, requests.exceptions.RequestException)
     try:
-        client = docker.DockerClient(base_url="unix://var/run/docker.sock")
-        container = client.containers.get(container_name)
-        health = container.attrs["State"].get("Health", {})
-        if "Status" in health:
-            return health["Status"]
-        return container.attrs["State"]["Status"]
-    except docker.errors.NotFound:
-        logging.error("Container '%s' not found", container_name)
-        return "unknown"
-    except docker.errors.DockerException as err:
-        logging.error("Docker error for '%s': %s", container_name, err)
+        containers = _docker_api().containers(all=True, filters=filters)
+    except errors as err:
+        # Reconnect and retry once before giving up on this poll.
+        logging.warning("Docker API error (%s); reconnecting", err)
+        _API = None
+        try:
+            containers = _docker_api().containers(all=True, filters=filters)
+        except errors as retry_err:
+            logging.error(
+                "Docker API error listing containers: %s", retry_err
+            )
+            _API = None
+            return statuses
+
+    for container in containers:
+        name = next(
+            (
+                n.lstrip("/")
+                for n in container.get("Names", [])
+                if n.lstrip("/") in statuses
+            ),
+            None,
+        )
+        if name is None:
+            continue
+
+        # The human-readable Status string carries the health sub-status,
+        # e.g. "Up 2 hours (healthy)"; otherwise fall back to the State.
+        human_status = container.get("Status", "")
+        if "(healthy)" in human_status:
+            statuses[name] = "healthy"
+        elif "(unhealthy)" in human_status:
+            statuses[name] = "unhealthy"
+        elif "(health" in human_status:
+            statuses[name] = _inspect_health(container["Id"])
+        else:
+            statuses[name] = container.get("State", "unknown")
+
+    return statuses
+
+
+def _inspect_health(container_id: str) -> str:
+    """Inspect a single container whose listed status is ambiguous."""
+    try:
+        state = _docker_api().inspect_container(container_id)["State"]
+        return state.get("Health", {}).get("Status", state["Status"])
+    except (
+        docker.errors.DockerException,
+        requests.exceptions.RequestException,
+    ) as err:
+        logging.error("Docker error inspecting '%s': %s", container_id, err)
         return "unknown"
 
 
-def send_alerts_grouped(service, alerts: List[Dict]) -> None:
+# Standard base64 -> urlsafe alphabet, as Gmail's raw field expects.
+_B64_TR = bytes.maketrans(b"+/", b"-_")
+
+
+def send_alerts_grouped(session: AuthorizedSession, alerts: List[Dict]) -> None:
     """Send a grouped alert email with container state changes."""
     if not alerts:
         return
 
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    subject = f"[DOCKER MONITOR {SERVER}] {len(alerts)} container(s) changed state"
+    server = CFG.server
 
-    body_lines = [f"State changes detected on server `{SERVER}` as of {now}:", ""]
+    now = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+    subject = f"[DOCKER MONITOR {server}] {len(alerts)} container(s) changed state"
+
+    body_lines = [f"State changes detected on server `{server}` as of {now}:", ""]
     for alert in alerts:
         body_lines.append(
             f"- {alert['type']}: `{alert['container']}` is now **{alert['status'].upper()}**"
@@ -97,97 +229,245 @@ def send_alerts_grouped(service, alerts: List[Dict]) -> None:
     body_lines.append("\nPlease check logs or containers as needed.")
     body = "\n".join(body_lines)
 
-    message = MIMEText(body)
-    message["to"] = ALERT_EMAIL
-    message["from"] = FROM_EMAIL
-    message["subject"] = subject
-
-    raw_message = {"raw": base64.urlsafe_b64encode(message.as_bytes()).decode()}
-    response = service.users().messages().send(userId="me", body=raw_message).execute()
+    # Plain-text alerts don't need the email.mime machinery; build the
+    # RFC 5322 bytes directly and urlsafe-b64encode them in one C call.
+    message = (
+        f"To: {CFG.alert_email}\r\n"
+        f"From: {CFG.from_email}\r\n"
+        f"Subject: {subject}\r\n"
+        "Content-Type: text/plain; charset=utf-8\r\n"
+        "\r\n"
+        f"{body}"
+    ).encode("utf-8")
+
+    raw = (
+        binascii.b2a_base64(message, newline=False)
+        .translate(_B64_TR)
+        .decode("ascii")
+    )
+    response = session.post(GMAIL_SEND_URL, json={"raw": raw}, timeout=30)
+    response.raise_for_status()
 
     logging.info("Grouped alert email sent for %d container(s).", len(alerts))
-    logging.debug("Gmail API response: %s", response)
+    logging.debug("Gmail API response: %s", response.text)
 
 
 def load_statuses() -> Dict:
     """Load container statuses from a local file."""
     if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, "r", encoding="utf-8") as file:
-            return json.load(file)
+        with open(STATE_FILE, "rb") as file:
+            return orjson.loads(file.read())
     return {}
 
 
 def save_statuses(statuses: Dict) -> None:
     """Save container statuses to a local file."""
-    with open(STATE_FILE, "w", encoding="utf-8") as file:
-        json.dump(statuses, file, indent=2)
+    # Write to a temp file and rename so a kill mid-write can't leave a
+    # torn state file behind.
+    tmp_file = STATE_FILE + ".tmp"
+    with open(tmp_file, "wb") as file:
+        file.write(orjson.dumps(statuses, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_file, STATE_FILE)
+
+
+# Alert type per (last, new) status class: "N" no previous status, "H"
+# healthy, "U" unhealthy. Only consulted when the status string changed, so
+# e.g. ("U", "U") is exited -> unknown (still an alert) and ("H", "H") is
+# running -> paused (a plain state change).
+_ALERT_TABLE = {
+    ("N", "H"): None,
+    ("N", "U"): "ALERT",
+    ("H", "H"): "STATE CHANGE",
+    ("H", "U"): "ALERT",
+    ("U", "H"): "RECOVERY",
+    ("U", "U"): "ALERT",
+}
+
+
+def _classify(status: Optional[str]) -> str:
+    """Bucket a status string into the classes used by _ALERT_TABLE."""
+    if status is None:
+        return "N"
+    return "U" if status in UNHEALTHY_STATES else "H"
+
+
+def classify_change(
+    container: str, last_status: Optional[str], status: str
+) -> Optional[Dict]:
+    """Classify a status transition, returning an alert dict or None."""
+    if status == last_status:
+        logging.debug("No alert sent: '%s' unchanged (%s)", container, status)
+        return None
+
+    alert_type = _ALERT_TABLE[(_classify(last_status), _classify(status))]
+    if alert_type is None:
+        logging.info(
+            "Startup: '%s' is healthy (%s), no alert sent.", container, status
+        )
+        return None
+    return {"container": container, "status": status, "type": alert_type}
 
 
-def poll_once(service, last_statuses: Dict) -> Dict:
-    """Poll container statuses and return updated values."""
+def poll_once(session: AuthorizedSession, last_statuses: Dict) -> Tuple[Dict, bool, int]:
+    """Poll container statuses; return updated values, a changed flag and
+    the number of containers currently unhealthy."""
     new_statuses = {}
     alerts = []
+    unhealthy_count = 0
 
-    for container in CONTAINER_NAMES:
-        status = get_container_health(container)
-        logging.debug("Container '%s' status: %s", container, status)
+    statuses = get_all_healths()
 
-        last_status = last_statuses.get(container)
+    # Hoisted so the per-container debug call is skipped entirely (no
+    # level check, no LogRecord) at the default INFO level.
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
 
-        if last_status is None:
-            if status in UNHEALTHY_STATES:
-                alerts.append(
-                    {"container": container, "status": status, "type": "ALERT"}
-                )
-            else:
-                logging.info(
-                    "Startup: '%s' is healthy (%s), no alert sent.", container, status
-                )
-        elif status != last_status:
-            if status in UNHEALTHY_STATES:
-                alerts.append(
-                    {"container": container, "status": status, "type": "ALERT"}
-                )
-            elif last_status in UNHEALTHY_STATES:
-                alerts.append(
-                    {"container": container, "status": status, "type": "RECOVERY"}
-                )
-            else:
-                alerts.append(
-                    {"container": container, "status": status, "type": "STATE CHANGE"}
-                )
-        else:
-            logging.debug("No alert sent: '%s' unchanged (%s)", container, status)
+    for container, status in statuses.items():
+        if debug_enabled:
+            logging.debug("Container '%s' status: %s", container, status)
+
+        alert = classify_change(container, last_statuses.get(container), status)
+        if alert:
+            alerts.append(alert)
 
+        if status in UNHEALTHY_STATES:
+            unhealthy_count += 1
         new_statuses[container] = status
 
-    send_alerts_grouped(service, alerts)
-    return new_statuses
+    send_alerts_grouped(session, alerts)
+    return new_statuses, new_statuses != last_statuses, unhealthy_count
+
+
+# Set by the SIGTERM handler so the event loop can exit promptly instead of
+# blocking on the next event and being SIGKILLed by docker stop.
+_STOP = threading.Event()
+
+# Feeds events from the watcher thread to the main loop. The SIGTERM handler
+# also drops _SHUTDOWN in here so the loop's blocking get() wakes immediately
+# instead of sleeping out its timeout past docker stop's 10 s grace period.
+_EVENTS_QUEUE: queue.Queue = queue.Queue()
+_SHUTDOWN = object()
+
+
+def _handle_sigterm(*_) -> None:
+    """Stop the monitor and wake the main loop so the state flush runs."""
+    _STOP.set()
+    _EVENTS_QUEUE.put(_SHUTDOWN)
+
+
+# Map docker lifecycle events to the status strings the poll path reports.
+_EVENT_STATUSES = {"die": "exited", "stop": "exited", "start": "running"}
+
+
+def _watch_events() -> None:
+    """Stream Docker health/state events into the queue (watcher thread)."""
+    while not _STOP.is_set():
+        try:
+            for event in _docker_api().events(
+                decode=True,
+                filters={"event": ["health_status", "die", "start", "stop"]},
+            ):
+                name = (
+                    event.get("Actor", {}).get("Attributes", {}).get("name")
+                )
+                if name not in CFG.containers:
+                    continue
+                action = event.get("Action", "")
+                if action.startswith("health_status"):
+                    status = action.partition(": ")[2] or "unknown"
+                else:
+                    status = _EVENT_STATUSES.get(action, "unknown")
+                _EVENTS_QUEUE.put((name, status))
+        except Exception as err:  # pylint: disable=broad-except
+            # A broken stream can surface as a DockerException, a requests
+            # ConnectionError or a raw urllib3 ProtocolError mid-read; this
+            # thread's whole job is to keep the subscription alive, so catch
+            # everything, log and re-subscribe.
+            logging.warning(
+                "Docker event stream error (%s); re-subscribing", err
+            )
+            time.sleep(1)
 
 
 def run_monitor() -> None:
-    """Run the main monitoring loop."""
-    if not CONTAINER_NAMES:
+    """Watch Docker events and alert on container state changes."""
+    if not CFG.containers:
         logging.error("No containers configured in %s", CONFIG_FILE)
         return
 
-    service = authenticate_gmail_service()
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+
+    session = authenticate_gmail_session()
     last_statuses = load_statuses()
 
-    while True:
-        logging.info("Polling Docker container statuses...")
-        last_statuses = poll_once(service, last_statuses)
+    # Initial full poll so anything already unhealthy at startup alerts.
+    logging.info("Polling Docker container statuses...")
+    last_statuses, changed, unhealthy_count = poll_once(session, last_statuses)
+    if changed:
         save_statuses(last_statuses)
+    logging.info(
+        "Watching %d container(s); %d in unhealthy state at startup.",
+        len(CFG.containers),
+        unhealthy_count,
+    )
 
-        unhealthy_now = {
-            c: s for c, s in last_statuses.items() if s in UNHEALTHY_STATES
-        }
-        logging.info(
-            "Monitoring complete. %d container(s) in unhealthy state.",
-            len(unhealthy_now),
-        )
-
-        time.sleep(POLL_INTERVAL)
+    threading.Thread(target=_watch_events, daemon=True).start()
+
+    heartbeat_interval = CFG.poll_interval * HEARTBEAT_MULTIPLIER
+    next_heartbeat = time.monotonic() + heartbeat_interval
+    last_flush = 0.0
+    pending_alerts: List[Dict] = []
+    # last_statuses is the source of truth; disk is only crash recovery, so
+    # writes are deferred to the heartbeat (or shutdown) instead of per event.
+    dirty = False
+
+    while not _STOP.is_set():
+        try:
+            item = _EVENTS_QUEUE.get(timeout=ALERT_FLUSH_INTERVAL)
+        except queue.Empty:
+            pass
+        else:
+            if item is _SHUTDOWN:
+                break
+            container, status = item
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(
+                    "Event: container '%s' is now %s", container, status
+                )
+            alert = classify_change(
+                container, last_statuses.get(container), status
+            )
+            if alert:
+                pending_alerts.append(alert)
+            if last_statuses.get(container) != status:
+                last_statuses[container] = status
+                dirty = True
+
+        now = time.monotonic()
+        if pending_alerts and now - last_flush >= ALERT_FLUSH_INTERVAL:
+            send_alerts_grouped(session, pending_alerts)
+            pending_alerts = []
+            last_flush = now
+
+        if now >= next_heartbeat:
+            # Reconcile in case any events were missed while (re)subscribing.
+            logging.info("Heartbeat: polling Docker container statuses...")
+            last_statuses, changed, unhealthy_count = poll_once(
+                session, last_statuses
+            )
+            if changed or dirty:
+                save_statuses(last_statuses)
+                dirty = False
+            logging.info(
+                "Heartbeat complete. %d container(s) in unhealthy state.",
+                unhealthy_count,
+            )
+            next_heartbeat = now + heartbeat_interval
+
+    if pending_alerts:
+        send_alerts_grouped(session, pending_alerts)
+    if dirty:
+        save_statuses(last_statuses)
+    logging.info("Received stop signal, shutting down.")
 
 
 if __name__ == "__main__":
@@ -4,10 +4,10 @@ if [ ! -d venv ]; then
     python3 -m venv venv
     source venv/bin/activate
     pip install --upgrade \
-        google-api-python-client \
-        google-auth-httplib2 \
-        google-auth-oauthlib \
+        google-auth \
+        requests \
         pyaml \
+        orjson \
         docker
 fi
 